@@ -1,13 +1,15 @@
 """Support for Deebot Sensor."""
 import logging
-from typing import Optional, Dict, Any
+from typing import List, Optional, Tuple
 
 from deebotozmo.constants import COMPONENT_MAIN_BRUSH, COMPONENT_SIDE_BRUSH, COMPONENT_FILTER
 from deebotozmo.events import CleanLogEvent, WaterInfoEvent, LifeSpanEvent, StatsEvent, EventListener, ErrorEvent, \
     StatusEvent
 from deebotozmo.vacuum_bot import VacuumBot
 from homeassistant.components.sensor import SensorEntity
-from homeassistant.const import STATE_UNKNOWN, CONF_DESCRIPTION
+from homeassistant.const import STATE_UNAVAILABLE, STATE_UNKNOWN, CONF_DESCRIPTION
+from homeassistant.core import callback
+from homeassistant.helpers.restore_state import RestoreEntity
 
 from .const import DOMAIN, LAST_ERROR
 from .helpers import get_device_info
@@ -15,6 +17,61 @@ from .hub import DeebotHub
 
 _LOGGER = logging.getLogger(__name__)
 
+_COMPONENT_ICON = {
+    COMPONENT_MAIN_BRUSH: "mdi:broom",
+    COMPONENT_SIDE_BRUSH: "mdi:broom",
+    COMPONENT_FILTER: "mdi:air-filter",
+}
+
+
+class _EventMultiplexer:
+    """Fan a single emitter subscription out to several sensors.
+
+    Multiple sensors of one vacbot listen on the same emitter; subscribing
+    each of them individually makes the library schedule a callback per
+    sensor per emit. The multiplexer holds the only subscription and routes
+    the event to the registered sensors directly.
+    """
+
+    __slots__ = ("_emitter", "_sensors", "_listener")
+
+    def __init__(self, emitter):
+        self._emitter = emitter
+        self._sensors: List[DeebotBaseSensor] = []
+        self._listener: Optional[EventListener] = None
+
+    def add(self, sensor: "DeebotBaseSensor") -> None:
+        """Register a sensor, subscribing to the emitter on first use."""
+        if self._listener is None:
+            self._listener = self._emitter.subscribe(self._on_event)
+        self._sensors.append(sensor)
+
+    def remove(self, sensor: "DeebotBaseSensor") -> None:
+        """Unregister a sensor, dropping the subscription with the last one."""
+        self._sensors.remove(sensor)
+        if not self._sensors and self._listener is not None:
+            self._listener.unsubscribe()
+            self._listener = None
+
+    async def _on_event(self, event) -> None:
+        # The sensor handlers are plain callbacks, so the fan-out needs no
+        # further scheduling on the loop
+        for sensor in self._sensors:
+            # Skip sensors not (yet) fully added to hass; writing their
+            # state would fail during startup or teardown
+            if sensor.hass is not None:
+                sensor._on_event(event)
+
+
+def _resolve_bot_name(vacuum_bot: VacuumBot) -> Tuple[str, str]:
+    """Return the (display name, device id) of the vacbot."""
+    did: str = vacuum_bot.vacuum.did
+    if vacuum_bot.vacuum.nick is not None:
+        return vacuum_bot.vacuum.nick, did
+
+    # In case there is no nickname defined, use the device id
+    return did, did
+
 
 async def async_setup_entry(hass, config_entry, async_add_devices):
     """Add sensors for passed config_entry in HA."""
@@ -22,191 +79,272 @@ async def async_setup_entry(hass, config_entry, async_add_devices):
 
     new_devices = []
     for vacbot in hub.vacuum_bots:
-        # General
-        new_devices.append(DeebotLastCleanImageSensor(vacbot))
-        new_devices.append(DeebotWaterLevelSensor(vacbot))
-        new_devices.append(DeebotLastErrorSensor(vacbot))
-
-        # Components
-        new_devices.append(DeebotComponentSensor(vacbot, COMPONENT_MAIN_BRUSH))
-        new_devices.append(DeebotComponentSensor(vacbot, COMPONENT_SIDE_BRUSH))
-        new_devices.append(DeebotComponentSensor(vacbot, COMPONENT_FILTER))
-
-        # Stats
-        new_devices.append(DeebotStatsSensor(vacbot, "area"))
-        new_devices.append(DeebotStatsSensor(vacbot, "time"))
-        new_devices.append(DeebotStatsSensor(vacbot, "type"))
-        new_devices.append(DeebotStatsSensor(vacbot, "cid"))
-        new_devices.append(DeebotStatsSensor(vacbot, "start"))
+        # Resolve the name/did once per vacbot instead of once per sensor
+        name, did = _resolve_bot_name(vacbot)
+
+        # The stats and lifespan emitters serve several sensors each; one
+        # multiplexed subscription per emitter replaces one per sensor
+        multiplexers = {
+            DeebotStatsSensor: _EventMultiplexer(vacbot.statsEvents),
+            DeebotComponentSensor: _EventMultiplexer(vacbot.lifespanEvents),
+        }
+
+        bot_sensors = []
+        for (cls, *args) in _SENSOR_SPEC:
+            multiplexer = multiplexers.get(cls)
+            if multiplexer is not None:
+                bot_sensors.append(cls(vacbot, name, did, multiplexer, *args))
+            else:
+                bot_sensors.append(cls(vacbot, name, did, *args))
+        new_devices.extend(bot_sensors)
+
+        # One status subscription per vacbot pushes the availability change
+        # to all its sensors; the sensors read it through their available
+        # property instead of subscribing individually
+        async def on_status_event(_: StatusEvent, sensors=bot_sensors):
+            for sensor in sensors:
+                if sensor.hass is not None and not sensor._always_available:
+                    sensor.async_write_ha_state()
+
+        listener: EventListener = vacbot.statusEvents.subscribe(on_status_event)
+        config_entry.async_on_unload(listener.unsubscribe)
 
     if new_devices:
         async_add_devices(new_devices)
 
 
-class DeebotBaseSensor(SensorEntity):
+class DeebotBaseSensor(SensorEntity, RestoreEntity):
     """Deebot base sensor"""
 
+    # SensorEntity is not slotted, so instances still get a __dict__ for the
+    # _attr_* values; slotting the integration fields keeps it from growing
+    __slots__ = ("_vacuum_bot",)
+
     _attr_should_poll = False
     _attr_entity_registry_enabled_default = False
 
-    def __init__(self, vacuum_bot: VacuumBot, device_id: str):
+    # Sensors whose value stays meaningful while the bot is offline set this
+    # to True so short connectivity drops cause no state churn for them
+    _always_available = False
+
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str, device_id: str):
         """Initialize the Sensor."""
         self._vacuum_bot: VacuumBot = vacuum_bot
 
-        if self._vacuum_bot.vacuum.nick is not None:
-            name: str = self._vacuum_bot.vacuum.nick
-        else:
-            # In case there is no nickname defined, use the device id
-            name = self._vacuum_bot.vacuum.did
-
         self._attr_name = f"{name}_{device_id}"
-        self._attr_unique_id = f"{self._vacuum_bot.vacuum.did}_{device_id}"
+        self._attr_unique_id = f"{did}_{device_id}"
+        # The device info never changes for the lifetime of the entity,
+        # so compute it once instead of on every property access
+        self._attr_device_info = get_device_info(vacuum_bot)
 
     @property
-    def device_info(self) -> Optional[Dict[str, Any]]:
-        return get_device_info(self._vacuum_bot)
+    def available(self) -> bool:
+        """Return True if the vacbot is reachable."""
+        return self._always_available or self._vacuum_bot.status.available
+
+    async def _async_on_event(self, event) -> None:
+        """Adapter for EventEmitter, which only takes coroutine callbacks."""
+        # Events can replay right after subscribing; don't write the state
+        # before the entity is fully added to hass
+        if self.hass is None:
+            return
+
+        self._on_event(event)
 
     async def async_added_to_hass(self) -> None:
-        """Set up the event listeners now that hass is ready."""
+        """Restore the last state so the sensor is not unknown until the first event."""
         await super().async_added_to_hass()
 
-        async def on_event(event: StatusEvent):
-            if not event.available:
-                self._attr_native_value = STATE_UNKNOWN
-                self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.statusEvents.subscribe(on_event)
-        self.async_on_remove(listener.unsubscribe)
+        last_state = await self.async_get_last_state()
+        if last_state is not None and last_state.state not in (STATE_UNKNOWN, STATE_UNAVAILABLE):
+            self._attr_native_value = last_state.state
 
 
 class DeebotLastCleanImageSensor(DeebotBaseSensor):
     """Deebot Sensor"""
 
+    __slots__ = ()
+
+    # The last clean image stays valid while the bot is offline
+    _always_available = True
+
     _attr_icon = "mdi:image-search"
 
-    def __init__(self, vacuum_bot: VacuumBot):
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str):
         """Initialize the Sensor."""
-        super(DeebotLastCleanImageSensor, self).__init__(vacuum_bot, "last_clean_image")
+        super(DeebotLastCleanImageSensor, self).__init__(vacuum_bot, name, did, "last_clean_image")
+
+    @callback
+    def _on_event(self, event: CleanLogEvent) -> None:
+        if event.logs:
+            value = event.logs[0].imageUrl
+        else:
+            value = STATE_UNKNOWN
+
+        # The library emits on every poll; skip the state write if nothing changed
+        if value == self._attr_native_value:
+            return
+
+        self._attr_native_value = value
+        self.async_write_ha_state()
 
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
         await super().async_added_to_hass()
 
-        async def on_event(event: CleanLogEvent):
-            if event.logs:
-                self._attr_native_value = event.logs[0].imageUrl
-            else:
-                self._attr_native_value = STATE_UNKNOWN
-            self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.cleanLogsEvents.subscribe(on_event)
+        listener: EventListener = self._vacuum_bot.cleanLogsEvents.subscribe(self._async_on_event)
         self.async_on_remove(listener.unsubscribe)
 
 
 class DeebotWaterLevelSensor(DeebotBaseSensor):
     """Deebot Sensor"""
 
+    __slots__ = ()
+
     _attr_icon = "mdi:water"
 
-    def __init__(self, vacuum_bot: VacuumBot):
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str):
         """Initialize the Sensor."""
-        super(DeebotWaterLevelSensor, self).__init__(vacuum_bot, "water_level")
+        super(DeebotWaterLevelSensor, self).__init__(vacuum_bot, name, did, "water_level")
+
+    @callback
+    def _on_event(self, event: WaterInfoEvent) -> None:
+        if event.amount and event.amount != self._attr_native_value:
+            self._attr_native_value = event.amount
+            self.async_write_ha_state()
 
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
         await super().async_added_to_hass()
 
-        async def on_event(event: WaterInfoEvent):
-            if event.amount:
-                self._attr_native_value = event.amount
-                self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.waterEvents.subscribe(on_event)
+        listener: EventListener = self._vacuum_bot.waterEvents.subscribe(self._async_on_event)
         self.async_on_remove(listener.unsubscribe)
 
 
 class DeebotComponentSensor(DeebotBaseSensor):
     """Deebot Sensor"""
 
+    __slots__ = ("_id", "_multiplexer")
+
     _attr_native_unit_of_measurement = "%"
 
-    def __init__(self, vacuum_bot: VacuumBot, device_id: str):
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str,
+                 multiplexer: _EventMultiplexer, device_id: str):
         """Initialize the Sensor."""
-        super(DeebotComponentSensor, self).__init__(vacuum_bot, device_id)
-        self._attr_icon = "mdi:air-filter" if device_id == COMPONENT_FILTER else "mdi:broom"
+        super(DeebotComponentSensor, self).__init__(vacuum_bot, name, did, device_id)
+        self._attr_icon = _COMPONENT_ICON[device_id]
         self._id = device_id
+        self._multiplexer = multiplexer
+
+    @callback
+    def _on_event(self, event: LifeSpanEvent) -> None:
+        if self._id == event.type and event.percent != self._attr_native_value:
+            self._attr_native_value = event.percent
+            self.async_write_ha_state()
 
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
         await super().async_added_to_hass()
 
-        async def on_event(event: LifeSpanEvent):
-            if self._id == event.type:
-                self._attr_native_value = event.percent
-                self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.lifespanEvents.subscribe(on_event)
-        self.async_on_remove(listener.unsubscribe)
+        self._multiplexer.add(self)
+        self.async_on_remove(lambda: self._multiplexer.remove(self))
 
 
 class DeebotStatsSensor(DeebotBaseSensor):
     """Deebot Sensor"""
 
-    def __init__(self, vacuum_bot: VacuumBot, type: str):
+    __slots__ = ("_multiplexer", "_extract")
+
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str,
+                 multiplexer: _EventMultiplexer, attribute: str):
         """Initialize the Sensor."""
 
-        super(DeebotStatsSensor, self).__init__(vacuum_bot, f"stats_{type}")
-        self._type = type
-        if type == "area":
+        super(DeebotStatsSensor, self).__init__(vacuum_bot, name, did, f"stats_{attribute}")
+        self._multiplexer = multiplexer
+        # Build the extractor once so the handler runs without branching;
+        # time is reported in seconds and shown in minutes
+        if attribute == "time":
+            self._extract = lambda event: round(t / 60) if (t := getattr(event, "time", None)) else None
+        else:
+            self._extract = lambda event, attr=attribute: getattr(event, attr, None)
+
+        if attribute == "area":
             self._attr_icon = "mdi:floor-plan"
             self._attr_native_unit_of_measurement = "mq"
-        elif type == "time":
+        elif attribute == "time":
             self._attr_icon = "mdi:timer-outline"
             self._attr_native_unit_of_measurement = "min"
-        elif type == "type":
+        elif attribute == "type":
             self._attr_icon = "mdi:cog"
 
+    @callback
+    def _on_event(self, event: StatsEvent) -> None:
+        value = self._extract(event)
+        if not value or value == self._attr_native_value:
+            return
+
+        self._attr_native_value = value
+        self.async_write_ha_state()
+
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
         await super().async_added_to_hass()
 
-        async def on_event(event: StatsEvent):
-            if hasattr(event, self._type):
-                value = getattr(event, self._type)
-
-                if not value:
-                    return
-
-                if self._type == "time":
-                    self._attr_native_value = round(value / 60)
-                else:
-                    self._attr_native_value = value
-
-                self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.statsEvents.subscribe(on_event)
-        self.async_on_remove(listener.unsubscribe)
+        self._multiplexer.add(self)
+        self.async_on_remove(lambda: self._multiplexer.remove(self))
 
 
 class DeebotLastErrorSensor(DeebotBaseSensor):
     """Deebot Sensor"""
 
+    __slots__ = ("_last_error",)
+
+    # The last error should stay visible while the bot is offline
+    _always_available = True
+
     _attr_icon = "mdi:alert-circle"
 
-    def __init__(self, vacuum_bot: VacuumBot):
+    def __init__(self, vacuum_bot: VacuumBot, name: str, did: str):
         """Initialize the Sensor."""
-        super(DeebotLastErrorSensor, self).__init__(vacuum_bot, LAST_ERROR)
+        super(DeebotLastErrorSensor, self).__init__(vacuum_bot, name, did, LAST_ERROR)
+        self._last_error = None
+
+    @callback
+    def _on_event(self, event: ErrorEvent) -> None:
+        if (event.code, event.description) == self._last_error:
+            return
+
+        self._last_error = (event.code, event.description)
+        self._attr_native_value = event.code
+        self._attr_extra_state_attributes = {
+            CONF_DESCRIPTION: event.description
+        }
+        self.async_write_ha_state()
 
     async def async_added_to_hass(self) -> None:
         """Set up the event listeners now that hass is ready."""
         await super().async_added_to_hass()
 
-        async def on_event(event: ErrorEvent):
-            self._attr_native_value = event.code
-            self._attr_extra_state_attributes = {
-                CONF_DESCRIPTION: event.description
-            }
-            self.async_write_ha_state()
-
-        listener: EventListener = self._vacuum_bot.errorEvents.subscribe(on_event)
+        listener: EventListener = self._vacuum_bot.errorEvents.subscribe(self._async_on_event)
         self.async_on_remove(listener.unsubscribe)
+
+
+# One entry per sensor of a vacbot: (class, *additional constructor arguments).
+# Built once at module level (after the classes above) so async_setup_entry
+# only has to instantiate.
+_SENSOR_SPEC = (
+    # General
+    (DeebotLastCleanImageSensor,),
+    (DeebotWaterLevelSensor,),
+    (DeebotLastErrorSensor,),
+    # Components
+    (DeebotComponentSensor, COMPONENT_MAIN_BRUSH),
+    (DeebotComponentSensor, COMPONENT_SIDE_BRUSH),
+    (DeebotComponentSensor, COMPONENT_FILTER),
+    # Stats
+    (DeebotStatsSensor, "area"),
+    (DeebotStatsSensor, "time"),
+    (DeebotStatsSensor, "type"),
+    (DeebotStatsSensor, "cid"),
+    (DeebotStatsSensor, "start"),
+)